@@ -1,9 +1,19 @@
 import discord
 from discord.ext import commands
 from discord.utils import get
+import array
+import asyncio
 import json
+import logging
+import math
 import os
 import random
+import signal
+
+try:
+    import orjson
+except ImportError:  # optional; fall back to the stdlib json module
+    orjson = None
 
 # ------------ CONFIG ------------
 TOKEN = os.getenv("TOKEN")   # <-- REPLACES hard-coded token
@@ -14,6 +24,7 @@ CASHIER_ROLE_NAME = "Cashier"           # role that can add chips
 # If you want to share chips with the blackjack bot,
 # use the same CHIPS_FILE name and put both bots in the same folder.
 CHIPS_FILE = "chips.json"
+FLUSH_INTERVAL = 1.0                    # seconds between chip file writes
 
 
 # ------------ BOT SETUP ------------
@@ -21,57 +32,204 @@ intents = discord.Intents.default()
 intents.message_content = True
 
 bot = commands.Bot(command_prefix=PREFIX, intents=intents, help_command=None)
+log = logging.getLogger(__name__)
+
+# Balances live in one contiguous int64 array; SLOT maps each user to
+# their index in it. User ids become string keys only on disk.
+SLOT = {}               # user_id (int) -> index into BAL
+BAL = array.array("q")  # chip balance per slot
+MAX_BALANCE = 2**63 - 1  # largest balance an int64 slot can hold
+_dirty = False       # chips changed since the last save
+_flush_task = None   # background task writing chips to disk
+_close_task = None   # bot.close() started by SIGTERM
+_last_bytes = b""    # contents of the last chips file we wrote
+_save_lock = asyncio.Lock()  # one chips file write at a time
 
-chips = {}  # user_id (str) -> int
+CASHIER_ROLE_ID = {}  # guild_id (int) -> Cashier role id (int)
 
 
 # ------------ CHIP STORAGE HELPERS ------------
 
-def load_chips():
-    global chips
-    if os.path.exists(CHIPS_FILE):
-        with open(CHIPS_FILE, "r") as f:
-            try:
-                chips = json.load(f)
-            except json.JSONDecodeError:
-                chips = {}
+if orjson is not None:
+    def _dumps(obj) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    _loads = orjson.loads
+else:
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode()
+    _loads = json.loads
+
+
+def _load_chips_sync():
+    global SLOT, BAL
+    SLOT, BAL = {}, array.array("q")
+    if not os.path.exists(CHIPS_FILE):
+        return
+    with open(CHIPS_FILE, "rb") as f:
+        raw = f.read()
+
+    bad_file = CHIPS_FILE + ".bad"
+    try:
+        data = _loads(raw)
+    except ValueError as e:
+        data, error = None, e
     else:
-        chips = {}
+        error = None if isinstance(data, dict) else "top level is not an object"
+    if error is not None:
+        # Starting empty would let the next save erase every balance,
+        # so move the unreadable file out of the way first.
+        os.replace(CHIPS_FILE, bad_file)
+        log.error("Could not load %s (%s); moved it to %s",
+                  CHIPS_FILE, error, bad_file)
+        return
+
+    # Fix up or skip bad entries one at a time (the blackjack bot shares
+    # this file and may write float payouts).
+    balances = {}
+    altered = False
+    for key, value in data.items():
+        if isinstance(value, float) and math.isfinite(value):
+            if not value.is_integer():
+                altered = True
+            value = round(value)
+        try:
+            user_id = int(key)
+        except ValueError:
+            user_id = None
+        if user_id is None or type(value) is not int:
+            log.warning("Skipping bad chips entry %r: %r", key, value)
+            altered = True
+            continue
+        if not 0 <= value <= MAX_BALANCE:
+            altered = True
+            value = min(max(0, value), MAX_BALANCE)
+        balances[user_id] = value
+
+    if altered:
+        # Keep the original so nothing the next save drops is lost for good
+        with open(bad_file, "wb") as f:
+            f.write(raw)
+        log.warning("Adjusted entries in %s; original saved to %s",
+                    CHIPS_FILE, bad_file)
+
+    SLOT = {user_id: i for i, user_id in enumerate(balances)}
+    BAL = array.array("q", balances.values())
+
+
+def _chips_bytes() -> bytes:
+    return _dumps({uid: BAL[s] for uid, s in SLOT.items()})
+
 
+def _write_chips_sync(data: bytes):
+    global _last_bytes
+    if data == _last_bytes:
+        return  # nothing changed on disk since the last save
 
-def save_chips():
-    with open(CHIPS_FILE, "w") as f:
-        json.dump(chips, f)
+    # Write to a temp file and swap it in, so a crash mid-write
+    # can never leave a truncated chips file behind.
+    tmp = CHIPS_FILE + ".tmp"
+    with open(tmp, "wb", buffering=len(data) + 1) as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, CHIPS_FILE)
+    _last_bytes = data
+
+
+def _save_chips_sync():
+    _write_chips_sync(_chips_bytes())
+
+
+async def load_chips_async():
+    await asyncio.to_thread(_load_chips_sync)
+
+
+async def save_chips_async():
+    # Serialize on the event loop so commands can't change SLOT mid-dump;
+    # only the disk write runs in the worker thread.
+    await asyncio.to_thread(_write_chips_sync, _chips_bytes())
 
 
 def get_balance(user_id: int) -> int:
-    return chips.get(str(user_id), 0)
+    slot = SLOT.get(user_id)
+    return BAL[slot] if slot is not None else 0
+
+
+def change_balance(user_id: int, amount: int) -> int:
+    """Adjust a balance (kept within 0..MAX_BALANCE) and return it."""
+    global _dirty
+    slot = SLOT.get(user_id)
+    current = BAL[slot] if slot is not None else 0
+    new_bal = min(max(0, current + amount), MAX_BALANCE)
+    if slot is None:
+        SLOT[user_id] = len(BAL)
+        BAL.append(new_bal)
+    else:
+        BAL[slot] = new_bal
+    _dirty = True
+    return new_bal
+
+
+async def flush_chips():
+    """Save chips if they changed since the last save."""
+    global _dirty
+    # Concurrent callers queue here; whoever runs next finds _dirty cleared
+    # if an earlier write already covered their change.
+    async with _save_lock:
+        if _dirty:
+            # clear first so changes made during the save mark it dirty again
+            _dirty = False
+            try:
+                await save_chips_async()
+            except BaseException:
+                _dirty = True  # keep the change pending for the next flush
+                raise
 
 
-def change_balance(user_id: int, amount: int):
-    uid = str(user_id)
-    chips[uid] = chips.get(uid, 0) + amount
-    if chips[uid] < 0:
-        chips[uid] = 0
-    save_chips()
+async def _flush_loop():
+    """Save pending chip changes every FLUSH_INTERVAL seconds."""
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL)
+        try:
+            await flush_chips()
+        except Exception:
+            # keep flushing; the change is still pending and will be retried
+            log.exception("Failed to save chips")
 
 
 # ------------ ROLE CHECK (CASHIER ONLY) ------------
 
+def cache_cashier_role(guild):
+    """Remember the id of the guild's Cashier role and return the role."""
+    role = get(guild.roles, name=CASHIER_ROLE_NAME)
+    if role is not None:
+        CASHIER_ROLE_ID[guild.id] = role.id
+    else:
+        CASHIER_ROLE_ID.pop(guild.id, None)
+    return role
+
+
+def get_cashier_role(guild):
+    """Return the guild's Cashier role via the id cache, or None."""
+    role_id = CASHIER_ROLE_ID.get(guild.id)
+    role = guild.get_role(role_id) if role_id is not None else None
+    if role is None:
+        # cache miss or stale id (e.g. guild was unavailable at READY)
+        role = cache_cashier_role(guild)
+    return role
+
+
 def is_cashier():
     async def predicate(ctx):
         if ctx.guild is None:
             return False
-        role = get(ctx.author.roles, name=CASHIER_ROLE_NAME)
-        return role is not None
+        role = get_cashier_role(ctx.guild)
+        return role is not None and ctx.author.get_role(role.id) is not None
     return commands.check(predicate)
 
 
 # ------------ ROULETTE LOGIC ------------
 
-# European roulette numbers: 0–36
-NUMBERS = list(range(0, 37))
-
 # Red numbers in European roulette
 RED_NUMBERS = {
     1, 3, 5, 7, 9,
@@ -81,31 +239,28 @@ RED_NUMBERS = {
 }
 BLACK_NUMBERS = set(range(1, 37)) - RED_NUMBERS  # 1–36 minus reds; 0 is green
 
+# Colour of each pocket, indexed by number
+COLOR = tuple(
+    "green" if n == 0 else ("red" if n in RED_NUMBERS else "black")
+    for n in range(37)
+)
+
+
+# Bound once so a spin skips the module attribute lookups
+_randrange = random.Random().randrange
+
 
 def spin_wheel() -> int:
-    return random.choice(NUMBERS)
+    # European roulette numbers: 0–36
+    return _randrange(37)
 
 
 def get_color(number: int) -> str:
-    if number == 0:
-        return "green"
-    elif number in RED_NUMBERS:
-        return "red"
-    else:
-        return "black"
+    return COLOR[number]
 
 
-def evaluate_bet(number: int, bet: str) -> int:
-    """
-    Returns payout factor including the original bet.
-    Example:
-      0  -> lose (no payout)
-      2  -> even-money win (1:1, returns 2x bet)
-      3  -> 2:1 win (returns 3x bet)
-      36 -> 35:1 win (returns 36x bet)
-    """
-    bet = bet.lower().strip()
-
+def _payout_factor(number: int, bet: str) -> int:
+    """Payout factor for an already-normalized bet (used to build PAYOUT)."""
     # Straight number bet
     if bet.isdigit():
         chosen = int(bet)
@@ -152,21 +307,86 @@ def evaluate_bet(number: int, bet: str) -> int:
     return 0
 
 
+# Every bet keyword the wheel understands
+BETS = (
+    "even", "odd", "red", "black", "low", "high",
+    "1st12", "2nd12", "3rd12",
+    *map(str, range(37)),
+)
+VALID_BETS = frozenset(BETS)
+
+
+def normalize_bet(bet: str) -> str:
+    """Lowercase and strip a bet; straight bets drop leading zeros ("07")."""
+    bet = bet.lower().strip()
+    return str(int(bet)) if bet.isdecimal() else bet
+
+
+# (number, bet) -> payout factor, computed once so a spin is a dict lookup
+PAYOUT = {
+    (number, bet): _payout_factor(number, bet)
+    for number in range(37)
+    for bet in BETS
+}
+
+
+def evaluate_bet(number: int, bet: str) -> int:
+    """
+    Returns payout factor including the original bet.
+    Example:
+      0  -> lose (no payout)
+      2  -> even-money win (1:1, returns 2x bet)
+      3  -> 2:1 win (returns 3x bet)
+      36 -> 35:1 win (returns 36x bet)
+    """
+    return PAYOUT.get((number, normalize_bet(bet)), 0)
+
+
+# Display text for each result, e.g. "**17** (black)"
+RESULT_TEXT = tuple(f"**{n}** ({COLOR[n]})" for n in range(37))
+
+
 def format_roulette_result(number: int) -> str:
-    color = get_color(number)
-    if number == 0:
-        return "**0** (green)"
-    return f"**{number}** ({color})"
+    return RESULT_TEXT[number]
 
 
 # ------------ EVENTS ------------
 
 @bot.event
 async def on_ready():
-    load_chips()
+    for guild in bot.guilds:
+        cache_cashier_role(guild)
     print(f"Logged in as {bot.user}")
 
 
+@bot.event
+async def on_guild_join(guild):
+    cache_cashier_role(guild)
+
+
+@bot.event
+async def on_guild_available(guild):
+    cache_cashier_role(guild)
+
+
+@bot.event
+async def on_guild_role_create(role):
+    if role.name == CASHIER_ROLE_NAME:
+        cache_cashier_role(role.guild)
+
+
+@bot.event
+async def on_guild_role_update(before, after):
+    if CASHIER_ROLE_NAME in (before.name, after.name):
+        cache_cashier_role(after.guild)
+
+
+@bot.event
+async def on_guild_role_delete(role):
+    if role.name == CASHIER_ROLE_NAME:
+        cache_cashier_role(role.guild)
+
+
 # ------------ GENERAL COMMANDS ------------
 
 @bot.command(name="balance")
@@ -186,8 +406,7 @@ async def addchips_cmd(ctx, member: discord.Member, amount: int):
         await ctx.send("Amount must be a positive integer.")
         return
 
-    change_balance(member.id, amount)
-    new_bal = get_balance(member.id)
+    new_bal = change_balance(member.id, amount)
     await ctx.send(
         f"✅ {ctx.author.mention} added **{amount}** chips to {member.mention}. "
         f"New balance: **{new_bal}** chips."
@@ -223,28 +442,29 @@ async def roulette_cmd(ctx, *args):
         )
         return
 
-    # Parse pairs: (amount, bet)
-    bets = []
-    for i in range(0, len(args), 2):
-        amount_str = args[i]
-        bet_str = args[i + 1]
-
-        # amount must be integer
-        try:
-            amount = int(amount_str)
-        except ValueError:
-            await ctx.send(f"Bet amount `{amount_str}` is not a valid integer.")
-            return
+    # Parse pairs: (amount, normalized bet)
+    try:
+        bets = [
+            (int(args[i]), normalize_bet(args[i + 1]))
+            for i in range(0, len(args), 2)
+        ]
+    except ValueError:
+        await ctx.send("Each bet amount must be a valid integer.")
+        return
 
+    # Validate bets and total the stake in one pass
+    total_stake = 0
+    for amount, bet in bets:
         if amount <= 0:
             await ctx.send("Each bet amount must be a positive integer.")
             return
-
-        bets.append((amount, bet_str))
+        if bet not in VALID_BETS:
+            await ctx.send(f"Unknown bet `{bet}`. See `!help` for bet options.")
+            return
+        total_stake += amount
 
     user_id = ctx.author.id
     balance = get_balance(user_id)
-    total_stake = sum(a for a, _ in bets)
 
     if total_stake > balance:
         await ctx.send(
@@ -254,36 +474,40 @@ async def roulette_cmd(ctx, *args):
         return
 
     # Deduct the total stake once
-    change_balance(user_id, -total_stake)
+    new_balance = change_balance(user_id, -total_stake)
 
     # Spin the wheel once for all bets
     number = spin_wheel()
     result_text = format_roulette_result(number)
 
     total_payout = 0
-    bet_lines = []
+    # Message fragments, joined once at the end
+    parts = [
+        "🎡 The wheel spins...\nResult: ", result_text,
+        "\n\n**Bet results:**\n",
+    ]
 
     for amount, bet in bets:
-        factor = evaluate_bet(number, bet)
+        # bets are already normalized, so skip evaluate_bet's normalize_bet
+        factor = PAYOUT.get((number, bet), 0)
         if factor <= 0:
             # lost: stake already deducted as part of total_stake
-            bet_lines.append(
-                f"• **{amount}** on `{bet}` → ❌ loss (-{amount})"
-            )
+            parts.append(f"• **{amount}** on `{bet}` → ❌ loss (-{amount})")
+            parts.append("\n")
         else:
             payout = amount * factor  # includes original stake
             profit = payout - amount
             total_payout += payout
-            bet_lines.append(
+            parts.append(
                 f"• **{amount}** on `{bet}` → ✅ win! "
                 f"Payout: **{payout}** (profit: **{profit}**)"
             )
+            parts.append("\n")
 
     # Pay out winners (if any)
     if total_payout > 0:
-        change_balance(user_id, total_payout)
+        new_balance = change_balance(user_id, total_payout)
 
-    new_balance = get_balance(user_id)
     net_result = total_payout - total_stake
 
     if net_result > 0:
@@ -293,17 +517,14 @@ async def roulette_cmd(ctx, *args):
     else:
         summary = "Overall result: 😐 You broke even."
 
-    message = (
-        f"🎡 The wheel spins...\n"
-        f"Result: {result_text}\n\n"
-        f"**Bet results:**\n"
-        + "\n".join(bet_lines)
-        + "\n\n"
-        + summary
-        + f"\nNew balance: **{new_balance}** chips."
-    )
+    parts += ["\n", summary, "\nNew balance: **", str(new_balance), "** chips."]
 
-    await ctx.send(message)
+    # Persist the spin while the reply is in flight to Discord
+    save_task = asyncio.create_task(flush_chips())
+    try:
+        await ctx.send("".join(parts))
+    finally:
+        await save_task
 
 
 @roulette_cmd.error
@@ -322,6 +543,10 @@ async def roulette_error(ctx, error):
 @bot.command(name="cashout")
 async def cashout_cmd(ctx, amount: int):
     """Cash out some chips and notify Cashiers."""
+    if ctx.guild is None:
+        await ctx.send("Cashouts must be requested in a server so Cashiers can see them.")
+        return
+
     if amount <= 0:
         await ctx.send("Cashout amount must be a positive integer.")
         return
@@ -336,28 +561,37 @@ async def cashout_cmd(ctx, amount: int):
         )
         return
 
-    change_balance(user_id, -amount)
-    new_bal = get_balance(user_id)
+    new_bal = change_balance(user_id, -amount)
 
-    await ctx.send(
+    msg = (
         f"💸 {ctx.author.mention}, you cashed out **{amount}** chips.\n"
         f"Remaining balance: **{new_bal}** chips.\n"
         f"Cashiers have been notified."
     )
 
-    cashier_role = get(ctx.guild.roles, name=CASHIER_ROLE_NAME)
+    # Notify Cashiers in the same message to save a round-trip
+    cashier_role = get_cashier_role(ctx.guild)
     if cashier_role is not None:
-        await ctx.send(
-            f"{cashier_role.mention} 💸 Cashout request:\n"
+        msg += (
+            f"\n\n{cashier_role.mention} 💸 Cashout request:\n"
             f"User: {ctx.author} (`{ctx.author.id}`)\n"
             f"Amount: **{amount}** chips\n"
             f"Balance after cashout: **{new_bal}** chips."
         )
+        await ctx.send(
+            msg, allowed_mentions=discord.AllowedMentions(roles=[cashier_role])
+        )
+    else:
+        await ctx.send(msg)
 
 
 @bot.command(name="cashoutall")
 async def cashoutall_cmd(ctx):
     """Cash out your entire balance and notify Cashiers."""
+    if ctx.guild is None:
+        await ctx.send("Cashouts must be requested in a server so Cashiers can see them.")
+        return
+
     user_id = ctx.author.id
     current_bal = get_balance(user_id)
 
@@ -367,58 +601,93 @@ async def cashoutall_cmd(ctx):
 
     change_balance(user_id, -current_bal)
 
-    cashier_role = get(ctx.guild.roles, name=CASHIER_ROLE_NAME)
-
-    await ctx.send(
+    msg = (
         f"💸 {ctx.author.mention}, you cashed out **{current_bal}** chips.\n"
         f"Your new balance is **0**.\n"
         f"Cashiers have been notified."
     )
 
+    # Notify Cashiers in the same message to save a round-trip
+    cashier_role = get_cashier_role(ctx.guild)
     if cashier_role is not None:
-        await ctx.send(
-            f"{cashier_role.mention} 💸 Full cashout request:\n"
+        msg += (
+            f"\n\n{cashier_role.mention} 💸 Full cashout request:\n"
             f"User: {ctx.author} (`{ctx.author.id}`)\n"
             f"Amount: **{current_bal}** chips\n"
             f"Balance after cashout: **0** chips."
         )
+        await ctx.send(
+            msg, allowed_mentions=discord.AllowedMentions(roles=[cashier_role])
+        )
+    else:
+        await ctx.send(msg)
 
 
 # ------------ HELP / COMMANDS ------------
 
+HELP_TEXT = (
+    "**🎰 Roulette Bot Commands**\n\n"
+    "__**Player Commands**__\n"
+    "`!balance` — Show your chip balance\n"
+    "`!roulette <amt1> <bet1> [<amt2> <bet2> ...]` — One spin with multiple bets\n"
+    "`!cashout <amount>` — Cash out some chips\n"
+    "`!cashoutall` — Cash out ALL chips\n\n"
+    "__**Roulette Bet Options**__\n"
+    "`red`, `black`, `even`, `odd`, `low`, `high`\n"
+    "`1st12`, `2nd12`, `3rd12` — Dozens\n"
+    "`0`–`36` — Straight number bets\n\n"
+    "__**Cashier Commands**__\n"
+    "`!addchips @user <amount>` — Add chips to a player\n\n"
+    "__**Notes**__\n"
+    "• Only users with the **Cashier** role can use `!addchips`.\n"
+    "• Players can only gain chips from wins or Cashier deposits.\n"
+    "• `!commands` shows this list as well."
+)
+
+
 @bot.command(name="help")
 async def help_cmd(ctx):
     """Show all commands for the roulette bot."""
-    help_text = (
-        "**🎰 Roulette Bot Commands**\n\n"
-        "__**Player Commands**__\n"
-        "`!balance` — Show your chip balance\n"
-        "`!roulette <amt1> <bet1> [<amt2> <bet2> ...]` — One spin with multiple bets\n"
-        "`!cashout <amount>` — Cash out some chips\n"
-        "`!cashoutall` — Cash out ALL chips\n\n"
-        "__**Roulette Bet Options**__\n"
-        "`red`, `black`, `even`, `odd`, `low`, `high`\n"
-        "`1st12`, `2nd12`, `3rd12` — Dozens\n"
-        "`0`–`36` — Straight number bets\n\n"
-        "__**Cashier Commands**__\n"
-        "`!addchips @user <amount>` — Add chips to a player\n\n"
-        "__**Notes**__\n"
-        "• Only users with the **Cashier** role can use `!addchips`.\n"
-        "• Players can only gain chips from wins or Cashier deposits.\n"
-        "• `!commands` shows this list as well."
-    )
-    await ctx.send(help_text)
+    await ctx.send(HELP_TEXT)
 
 
 @bot.command(name="commands")
 async def commands_cmd(ctx):
     """Alias for !help."""
-    await help_cmd(ctx)
+    await ctx.send(HELP_TEXT)
 
 
 # ------------ RUN BOT ------------
+
+def _on_sigterm():
+    global _close_task
+    # keep a reference so the task can't be garbage-collected mid-close
+    _close_task = asyncio.create_task(bot.close())
+
+
+async def main():
+    global _flush_task
+    discord.utils.setup_logging()  # bot.run() used to do this for us
+    # Load before connecting so startup disk I/O can't delay the gateway
+    await load_chips_async()
+    _flush_task = asyncio.create_task(_flush_loop())
+    # Heroku stops workers with SIGTERM; close cleanly so the final save runs
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, _on_sigterm)
+    except NotImplementedError:  # no signal handlers on Windows
+        pass
+    async with bot:
+        await bot.start(TOKEN)
+
+
 if __name__ == "__main__":
-    load_chips()
-    bot.run(TOKEN)
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # asyncio.run waits for any in-flight write, so this can't race it
+        if _dirty:
+            _save_chips_sync()
 
 